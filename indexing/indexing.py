@@ -1,72 +1,261 @@
 <<<<<<< HEAD
-from tqdm import tqdm
+from tqdm.asyncio import tqdm_asyncio
 import asyncio
 import aiohttp
 import os
-import pandas as pd
+import csv
 =======
 import os
 import asyncio
 import aiohttp
 import json
 >>>>>>> c4854f38ceaacc162530ac3bd85ba4d41afc69b5
-from oauth2client.service_account import ServiceAccountCredentials
-import json
+from collections import Counter, deque
+import jwt
+import orjson
+import random
+import time
 
 # Constants
 SCOPES = ["https://www.googleapis.com/auth/indexing"]
 ENDPOINT = "https://indexing.googleapis.com/v3/urlNotifications:publish"
+TOKEN_URI = "https://oauth2.googleapis.com/token"
 URLS_PER_ACCOUNT = 200
+MIN_CONCURRENCY = 2
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "64"))
+INITIAL_CONCURRENCY = min(20, MAX_CONCURRENCY)
+MAX_ATTEMPTS = 5
+MAX_BACKOFF = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Optional cap on requests per account in any 60 second window; unset or 0 disables it. Google's
+# publish quota is per minute per Cloud project, not per service account, so accounts that share a
+# project share that quota and RPM should be set to their share of it.
+RPM = int(os.getenv("RPM", "0"))
+TOKEN_REFRESH_MARGIN = 300  # Refresh the access token this many seconds before it expires
+TOKEN_RETRY_DELAY = 15  # Wait between attempts when a token refresh fails
+_BODY_TMPL = b'{"url":%s,"type":"URL_UPDATED"}'  # Only the URL varies between requests
+
+# Use the faster libuv-based event loop when it is installed
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
+class AIMDLimiter:
+    """Adaptive concurrency cap: additive increase on success, multiplicative decrease on 429/5xx."""
+
+    def __init__(self, initial, minimum, maximum, increase=1, decrease=0.5):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self._successes = 0
+        self._sent = 0  # Sequence number of the latest request let through
+        self._last_cut = 0  # Value of _sent when the limit was last decreased
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        """Wait for a free slot and return a ticket to hand back to release()."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            self._sent += 1
+            return self._sent
+
+    async def release(self, ticket, status=None):
+        async with self._cond:
+            self.in_flight -= 1
+            if status is not None:
+                if status == 429 or status >= 500:
+                    # Requests sent before the last cut belong to the same congestion event,
+                    # so a burst of failures only halves the limit once
+                    if ticket > self._last_cut:
+                        self.limit = max(self.minimum, int(self.limit * self.decrease))
+                        self._last_cut = self._sent
+                        self._successes = 0
+                elif status < 400:
+                    # Grow by one slot per full window of successful requests
+                    self._successes += 1
+                    if self._successes >= self.limit:
+                        self.limit = min(self.maximum, self.limit + self.increase)
+                        self._successes = 0
+            self._cond.notify_all()
+
+class SlidingWindowLimiter:
+    """Allows at most `rate` requests in any rolling `period` seconds."""
+
+    def __init__(self, rate, period=60):
+        self.rate = rate
+        self.period = period
+        self._sent = deque()
+        self._lock = asyncio.Lock()
 
-from aiohttp.client_exceptions import ServerDisconnectedError
+    async def wait(self):
+        # Waiters queue on the lock, so requests go out in arrival order
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                while self._sent and self._sent[0] <= now - self.period:
+                    self._sent.popleft()
+                if len(self._sent) < self.rate:
+                    break
+                await asyncio.sleep(self._sent[0] + self.period - now)
+            self._sent.append(loop.time())
 
-async def send_url(session, http, url):
-    content = {
-        'url': url.strip(),
-        'type': "URL_UPDATED"
-    }
-    for _ in range(3):  # Retry up to 3 times
+class _Retryable(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(status)
+        self.status = status
+        self.retry_after = retry_after
+
+def parse_retry_after(value, default=2):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+async def send_url(session, limiter, throttle, credentials, url):
+    body = _BODY_TMPL % orjson.dumps(url)
+    result = 500, b'{"error": {"code": 500, "message": "Request failed after multiple retries"}}'  # Returned if all retries fail
+    for attempt in range(MAX_ATTEMPTS):
         try:
-            async with session.post(ENDPOINT, json=content, headers={"Authorization": f"Bearer {http}"}, ssl=False) as response:
-                return await response.text()
-        except ServerDisconnectedError:
-            await asyncio.sleep(2)  # Wait for 2 seconds before retrying
-            continue
-    return '{"error": {"code": 500, "message": "Server Disconnected after multiple retries"}}'  # Return a custom error message after all retries fail
-
-async def indexURL(http, urls):
-    successful_urls = 0
-    error_429_count = 0
-    other_errors_count = 0
-    tasks = []
-
-    async with aiohttp.ClientSession() as session:
-        # Using tqdm for progress bar
-        for url in tqdm(urls, desc="Processing URLs", unit="url"):
-            tasks.append(send_url(session, http, url))
-
-        results = await asyncio.gather(*tasks)
-
-        for result in results:
-            data = json.loads(result)
-            if "error" in data:
-                if data["error"]["code"] == 429:
-                    error_429_count += 1
-                else:
-                    other_errors_count += 1
-            else:
-                successful_urls += 1
-
-    print(f"\nTotal URLs Tried: {len(urls)}")
-    print(f"Successful URLs: {successful_urls}")
-    print(f"URLs with Error 429: {error_429_count}")
-
-def setup_http_client(json_key_file):
-    credentials = ServiceAccountCredentials.from_json_keyfile_name(json_key_file, scopes=SCOPES)
-    token = credentials.get_access_token().access_token
-    return token
-
-def main():
+            status = None
+            # Read the token on every attempt so a background refresh is picked up
+            headers = {"Authorization": f"Bearer {credentials.token}", "Content-Type": "application/json"}
+            ticket = await limiter.acquire()
+            try:
+                # Take the rate-window timestamp only once the request holds a slot and is about to go out
+                if throttle is not None:
+                    await throttle.wait()
+                async with session.post(ENDPOINT, data=body, headers=headers, ssl=False) as response:
+                    status = response.status
+                    if status < 400:
+                        # Drain the small body so the connection goes back to the pool for reuse
+                        await response.read()
+                        return status, None
+                    result = status, await response.read()  # Raw bytes, left undecoded
+                    if status not in RETRY_STATUSES:
+                        return result
+                    raise _Retryable(status, response.headers.get("Retry-After"))
+            finally:
+                await limiter.release(ticket, status)
+        except (_Retryable, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                break
+            # Exponential backoff with full jitter, unless the server told us how long to wait.
+            # Either way never park a request for longer than MAX_BACKOFF.
+            backoff = random.uniform(0, min(MAX_BACKOFF, 2 ** attempt))
+            delay = parse_retry_after(getattr(e, "retry_after", None), default=backoff)
+            await asyncio.sleep(min(MAX_BACKOFF, delay))
+    return result
+
+async def keep_token_fresh(session, credentials):
+    while True:
+        remaining = credentials.expiry - time.time()
+        await asyncio.sleep(max(0, remaining - TOKEN_REFRESH_MARGIN))
+        try:
+            await credentials.refresh(session)
+        except Exception as e:
+            # Keep trying: the current token is still good until it expires
+            tqdm_asyncio.write(f"\nWarning: token refresh failed, retrying in {TOKEN_RETRY_DELAY}s: {e!r}")
+            await asyncio.sleep(TOKEN_RETRY_DELAY)
+
+def bucketize(status):
+    if status < 400:
+        return "ok"
+    if status == 429:
+        return "429"
+    return "other"
+
+async def indexURL(session, credentials, urls, account=1):
+    counts = Counter()
+    limiter = AIMDLimiter(INITIAL_CONCURRENCY, MIN_CONCURRENCY, MAX_CONCURRENCY)
+    throttle = SlidingWindowLimiter(RPM) if RPM > 0 else None
+
+    refresher = asyncio.create_task(keep_token_fresh(session, credentials))
+    tasks = [asyncio.create_task(send_url(session, limiter, throttle, credentials, url)) for url in urls]
+
+    try:
+        # Progress bar advances as each request completes; results are tallied and dropped
+        for coro in tqdm_asyncio.as_completed(tasks, total=len(urls), desc=f"Account {account}", unit="url",
+                                              position=account - 1):
+            status, _ = await coro
+            counts[bucketize(status)] += 1
+    finally:
+        # Don't leave this account's requests or token refresher running if the batch is aborted
+        for task in tasks:
+            task.cancel()
+        refresher.cancel()
+
+    # Other accounts' progress bars may still be drawing, so write through tqdm
+    tqdm_asyncio.write(f"\nAccount {account} finished\n"
+                       f"Total URLs Tried: {len(urls)}\n"
+                       f"Successful URLs: {counts['ok']}\n"
+                       f"URLs with Error 429: {counts['429']}\n"
+                       f"URLs with Other Errors: {counts['other']}")
+
+class ServiceAccountToken:
+    """OAuth access token for a service account, obtained with a signed JWT assertion."""
+
+    def __init__(self, info):
+        self.email = info["client_email"]
+        self.private_key = info["private_key"]
+        self.token_uri = info.get("token_uri", TOKEN_URI)
+        self.token = None
+        self.expiry = 0
+
+    @property
+    def valid(self):
+        return self.token is not None and time.time() < self.expiry - TOKEN_REFRESH_MARGIN
+
+    async def refresh(self, session):
+        now = int(time.time())
+        claim = {
+            "iss": self.email,
+            "scope": " ".join(SCOPES),
+            "aud": self.token_uri,
+            "iat": now,
+            "exp": now + 3600,
+        }
+        # RS256 signing is CPU-bound, keep it off the event loop
+        assertion = await asyncio.to_thread(jwt.encode, claim, self.private_key, algorithm="RS256")
+        data = {"grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer", "assertion": assertion}
+        async with session.post(self.token_uri, data=data) as response:
+            response.raise_for_status()
+            grant = await response.json()
+        self.token = grant["access_token"]
+        self.expiry = now + grant.get("expires_in", 3600)
+
+# Service account credentials keyed by JSON key file, reused for the life of the process
+_credentials_cache = {}
+
+def load_service_account(json_key_file):
+    with open(json_key_file, "rb") as f:
+        return ServiceAccountToken(orjson.loads(f.read()))
+
+async def setup_http_client(session, json_key_file):
+    credentials = _credentials_cache.get(json_key_file)
+    if credentials is None:
+        credentials = await asyncio.to_thread(load_service_account, json_key_file)
+        _credentials_cache[json_key_file] = credentials
+    if not credentials.valid:
+        await credentials.refresh(session)
+    return credentials
+
+def create_session(num_accounts=1):
+    # Reuse keep-alive connections and cache DNS for the indexing endpoint. Every account's limiter
+    # can reach MAX_CONCURRENCY, so size the pool for all of them to avoid queueing inside aiohttp.
+    connections_per_host = MAX_CONCURRENCY * max(1, num_accounts)
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=connections_per_host, ttl_dns_cache=300,
+                                     enable_cleanup_closed=True, keepalive_timeout=75)
+    timeout = aiohttp.ClientTimeout(total=30, connect=10)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+async def main():
 <<<<<<< HEAD
     # Check if CSV file exists
     if not os.path.exists("data.csv"):
@@ -81,10 +270,19 @@ def main():
 
     # Read all URLs from CSV
     try:
-        all_urls = pd.read_csv("data.csv")["URL"].tolist()
+        # utf-8-sig drops the BOM that Excel puts in front of the first header
+        with open("data.csv", newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            if "URL" not in (reader.fieldnames or []):
+                raise KeyError("URL")
+            all_urls = [row["URL"] for row in reader if row.get("URL")]
     except Exception as e:
         print(f"Error reading data.csv: {e}")
         return
+
+    # Strip whitespace and drop blank or duplicate URLs (keeping order) so none burns quota twice
+    all_urls = [u.strip() for u in all_urls if u and u.strip()]
+    all_urls = list(dict.fromkeys(all_urls))
 =======
     # Get parameters from environment variables
     try:
@@ -93,7 +291,7 @@ def main():
         print("Invalid number of accounts. Please enter a valid number.")
         return
     
-    url = os.getenv('URL')
+    url = os.getenv('URL', '').strip()
     if not url:
         print("Error: URL parameter not provided!")
         return
@@ -104,9 +302,9 @@ def main():
     all_urls = [url] * (num_accounts * urls_per_account)
 >>>>>>> c4854f38ceaacc162530ac3bd85ba4d41afc69b5
 
-    # Process URLs for each account
+    # Collect the URL batch for each account
+    accounts = []
     for i in range(num_accounts):
-        print(f"\nProcessing URLs for Account {i+1}...")
         json_key_file = f"account{i+1}.json"
 
         # Check if account JSON file exists
@@ -116,16 +314,33 @@ def main():
 
         start_index = i * URLS_PER_ACCOUNT
         end_index = start_index + URLS_PER_ACCOUNT
-        urls_for_account = all_urls[start_index:end_index]
-        
-        http = setup_http_client(json_key_file)
-        asyncio.run(indexURL(http, urls_for_account))
+        accounts.append((i + 1, json_key_file, all_urls[start_index:end_index]))
+
+    async with create_session(len(accounts)) as session:
+        # Fetch every account's token concurrently; one bad key must not stop the others
+        credentials = await asyncio.gather(*[setup_http_client(session, json_key_file)
+                                             for _, json_key_file, _ in accounts], return_exceptions=True)
+        ready = []
+        for (account, json_key_file, urls_for_account), account_credentials in zip(accounts, credentials):
+            if isinstance(account_credentials, Exception):
+                tqdm_asyncio.write(f"Error: could not get a token from {json_key_file}: {account_credentials}")
+                continue
+            ready.append((account, account_credentials, urls_for_account))
+
+        # Accounts have independent quotas, so process them all at once over one shared session
+        print(f"\nProcessing URLs for {len(ready)} account(s)...")
+        results = await asyncio.gather(*[indexURL(session, account_credentials, urls_for_account, account)
+                                         for account, account_credentials, urls_for_account in ready],
+                                       return_exceptions=True)
+        for (account, _, _), result in zip(ready, results):
+            if isinstance(result, Exception):
+                tqdm_asyncio.write(f"\nError: Account {account} failed: {result!r}")
 
 # Call the main function
 if __name__ == "__main__":
     try:
-        main()
+        asyncio.run(main())
     except KeyboardInterrupt:
         print("\nScript paused. Press Enter to resume or Ctrl+C again to exit.")
         input()
-        main()
+        asyncio.run(main())